@@ -1,12 +1,56 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
-import plotly.graph_objects as go
-import plotly.express as px
+import hashlib
+import io
 import re
-import time
-import openpyxl
 import streamlit.components.v1 as components
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Headers that are already month labels, e.g. "Apr-25" / "Apr-2025"
+_MONTH_RE = re.compile(r'^[A-Za-z]{3}-\d{2,4}$')
+
+# Node colors (d3.schemeCategory10, as in plotly's px.colors.qualitative.D3), assigned by node index
+_NODE_PALETTE = np.array([
+    "#1F77B4", "#FF7F0E", "#2CA02C", "#D62728", "#9467BD",
+    "#8C564B", "#E377C2", "#7F7F7F", "#BCBD22", "#17BECF",
+])
+
+# Optional drill-down columns offered as Sankey filters
+FILTER_COLS = ("Plant", "Material")
+
+# Sankeys with more aggregated links keep the largest ones and route the rest of each source into "Other"
+# (sources with the smallest remainders share one "Other sources" -> "Other" link)
+_MAX_SANKEY_LINKS = 2000
+_OTHER_NODE = "Other"
+_OTHER_SOURCES_NODE = "Other sources"
+
+# Above this many links the D3 Sankey paints links on a <canvas> instead of one SVG path each
+_CANVAS_LINK_THRESHOLD = 500
+
+# Rust-backed Excel reader (several times faster than openpyxl); optional
+try:
+    import python_calamine  # noqa: F401
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
+# Multithreaded, vectorized SQL engine for the edge pre-aggregation; optional
+try:
+    import duckdb
+    HAS_DUCKDB = True
+except ImportError:
+    HAS_DUCKDB = False
+
+# Native JSON encoder (understands NumPy arrays/scalars); optional
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
 # ============================================================
 # ✅ Page Configuration
@@ -98,20 +142,51 @@ st.markdown(
 # ============================================================
 # ✅ Load File Function (Efficient & Cached)
 # ============================================================
-@st.cache_data(show_spinner=False)
-def load_data(upload_file, sheet_name=None):
-    """Loads CSV or Excel sheet efficiently."""
-    if upload_file is None:
-        return None
-    file_name = upload_file.name.lower()
+def excel_engine(file_name):
+    """Returns the pandas Excel engine: calamine if installed, else openpyxl (.xlsx) / xlrd (.xls)."""
+    if HAS_CALAMINE:
+        return "calamine"
+    return "openpyxl" if file_name.endswith(".xlsx") else "xlrd"
+
+def file_digest(raw):
+    """Content hash of the uploaded bytes; computed once per rerun and used as the cache key."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+def _normalize(df):
+    """One-time fix-ups on a freshly parsed frame, before it is cached."""
+    df.columns = df.columns.map(str) # string conversion for all column headers
+    # filter columns as categoricals: small int codes instead of Python objects
+    for col in FILTER_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+# cache_resource hands back the cached object itself (no pickle round-trip per rerun),
+# so callers must treat the returned DataFrame as read-only.
+# Loaders are keyed on the digest only: Streamlit does not hash "_"-prefixed arguments.
+@st.cache_resource(show_spinner=False)
+def _load_csv(digest, _raw):
+    return _normalize(pd.read_csv(io.BytesIO(_raw)))
+
+@st.cache_resource(show_spinner=False)
+def _load_sheet_names(digest, _raw, engine):
+    return pd.ExcelFile(io.BytesIO(_raw), engine=engine).sheet_names
+
+@st.cache_resource(show_spinner=False)
+def _load_sheet(digest, _raw, sheet_name, engine):
+    return _normalize(pd.read_excel(io.BytesIO(_raw), sheet_name=sheet_name, engine=engine))
+
+def load_data(file_name, raw, digest, sheet_name=None):
+    """Loads CSV or Excel sheet efficiently (parsed once per file content)."""
     try:
         if file_name.endswith(".csv"):
-            return pd.read_csv(upload_file)
+            return _load_csv(digest, raw)
         elif file_name.endswith((".xlsx", ".xls")):
+            engine = excel_engine(file_name)
             if sheet_name is None:
-                return pd.ExcelFile(upload_file, engine="openpyxl").sheet_names
+                return _load_sheet_names(digest, raw, engine)
             else:
-                return pd.read_excel(upload_file, sheet_name=sheet_name, engine="openpyxl")
+                return _load_sheet(digest, raw, sheet_name, engine)
         else:
             st.error("❌ Unsupported file format. Please upload CSV or Excel.")
             return None
@@ -139,20 +214,22 @@ data = None
 # ============================================================
 if upload_file:
     file_name = upload_file.name.lower()
+    raw = upload_file.getvalue()
+    digest = file_digest(raw)
+    selected_sheet = None
     if file_name.endswith(".csv"):
-        data = load_data(upload_file)
+        data = load_data(file_name, raw, digest)
     elif file_name.endswith((".xlsx", ".xls")):
-        sheet_names = load_data(upload_file)
+        sheet_names = load_data(file_name, raw, digest)
         if sheet_names:
             selected_sheet = st.sidebar.selectbox("Select Sheet", sheet_names)
-            data = load_data(upload_file, sheet_name=selected_sheet)
+            data = load_data(file_name, raw, digest, sheet_name=selected_sheet)
+    # identifies the loaded frame for caches that take the frame itself unhashed
+    data_key = (digest, selected_sheet)
 
     if data is not None:
-        data = data.copy()
-        data.columns = data.columns.map(str) # this line adds string conversion to all column headers
+        # data is the cached, already-normalized frame shared by every rerun: read-only
         st.session_state["data"] = data
-        with st.spinner("Loading data..."):
-            time.sleep(0.5)
         st.sidebar.success("✅ Data Loaded Successfully!")
 
 # ============================================================
@@ -164,20 +241,35 @@ def detect_month_cols(df):
     1. display_to_real : dict (Apr-25 -> 2025-04-01 00:00:00)
     2. display_cols    : list for selectbox
     """
-    display_to_real = {}
-
-    for col in df.columns:
-        try:
-            dt = pd.to_datetime(col)
-            display_name = dt.strftime('%b-%y')
-            display_to_real[display_name] = str(col)
-        except Exception:
-            col_str = str(col)
-            if col_str.upper().startswith("FY"):
-                display_to_real[col_str] = col_str
+    return _detect_month_cols(tuple(map(str, df.columns)))
+
+@st.cache_data(show_spinner=False)
+def _detect_month_cols(cols_tuple):
+    """Header scan behind detect_month_cols, memoized on the column names."""
+    cols = pd.Index(cols_tuple)
+
+    # one vectorized parse over all headers instead of a try/except per column;
+    # ready-made month labels are kept as-is (to_datetime reads "Apr-25" as 25 April, year 1)
+    is_label = cols.str.match(_MONTH_RE)
+    dt = pd.to_datetime(cols, errors="coerce", format="mixed")
+    is_date = dt.notna() & ~is_label
+    display = np.where(is_date, dt.strftime('%b-%y'), cols)
+    keep = is_label | is_date | cols.str.upper().str.startswith("FY")
+
+    display_to_real = dict(zip(display[keep], cols[keep]))
 
     return display_to_real, list(display_to_real.keys())
 
+@st.cache_resource(show_spinner=False)
+def group_index(data_key, _df, col):
+    """Row positions (int64 arrays) for each distinct value of col (NaN excluded), built once per frame."""
+    return _df.groupby(col, sort=False, observed=True).indices
+
+def filter_eq(data_key, df, col, value):
+    """Rows of the frame identified by data_key where col == value: a positional take, no column scan."""
+    positions = group_index(data_key, df, col).get(value)
+    return df.iloc[:0] if positions is None else df.take(positions)
+
 def select_columns(df):
     st.sidebar.markdown(
         "<h3 style='color:#b24dff;text-align:center;'>Select Columns</h3>",
@@ -204,51 +296,207 @@ def select_columns(df):
 
     return source_col, target_col, value_col
 
-def plot_sankey_d3(df, source_col, target_col, value_col, title="Sankey Diagram", height=600):
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def to_json(obj):
+    """Serializes the chart payload, with orjson when installed."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(obj, default=_json_default)
+
+def _valid_rows(src, tgt, val):
+    """Row mask shared by all Sankey inputs: finite positive value, both endpoints present, no self-loop."""
+    return np.isfinite(val) & (val > 0) & pd.notna(src) & pd.notna(tgt) & (src != tgt)
+
+@st.cache_resource(show_spinner=False)
+def preaggregate(data_key, _df, source_col, target_col, value_col):
+    """
+    Sums value_col per (Plant, Material, source, target) over the valid rows, once per
+    upload and column choice. The overall and filtered Sankeys are all built from this
+    much smaller table instead of the raw rows.
+    """
+    keys = list(dict.fromkeys(
+        [c for c in FILTER_COLS if c in _df.columns] + [source_col, target_col]
+    ))
+
+    # Coercion and the _valid_rows mask happen here for both backends, so the chart does
+    # not depend on whether duckdb is installed. Grouping is on int32 source/target codes,
+    # not Python strings; labels (with their original types) are mapped back onto the
+    # (much smaller) aggregated table only. Values and sums stay float64: float32 rows
+    # alone already shift the 2-decimal node labels
+    val = np.ascontiguousarray(pd.to_numeric(_df[value_col], errors="coerce").to_numpy(dtype=np.float64))
+    src = np.ascontiguousarray(_df[source_col].to_numpy())
+    tgt = np.ascontiguousarray(_df[target_col].to_numpy())
+    keep = _valid_rows(src, tgt, val)
+    src_codes, src_labels = pd.factorize(src[keep])
+    tgt_codes, tgt_labels = pd.factorize(tgt[keep])
+
+    filters = [c for c in keys if c not in (source_col, target_col)]
+    rows = _df.loc[keep, filters].assign(
+        _src=src_codes.astype(np.int32), _tgt=tgt_codes.astype(np.int32), **{value_col: val[keep]}
+    )
+    if HAS_DUCKDB:
+        agg = _sum_edges_duckdb(rows, filters, value_col)
+    else:
+        agg = rows.groupby(filters + ["_src", "_tgt"], observed=True, sort=False, dropna=False, as_index=False)[value_col].sum()
+    agg[source_col] = src_labels.take(agg["_src"].to_numpy())
+    agg[target_col] = tgt_labels.take(agg["_tgt"].to_numpy())
+    return agg[keys + [value_col]]
 
-    df = df.copy()
-    df.columns = df.columns.astype(str)
-    if value_col not in df.columns:
-        st.error(f"Value column '{value_col}' not found in data.")
-        return
-    df[value_col] = pd.to_numeric(df[value_col], errors="coerce").fillna(0)
-    df = df[df[value_col] > 0].copy()
+@st.cache_resource(show_spinner=False)
+def _duckdb_connection():
+    return duckdb.connect()
 
-    df = df[df[source_col] != df[target_col]].copy()
+def _sql_name(col):
+    return '"' + col.replace('"', '""') + '"'
 
-    if df.empty:
-        st.warning("⚠️ No data available to plot the Sankey diagram.")
-        return
+def _sum_edges_duckdb(rows, filters, value_col):
+    """
+    preaggregate's group-sum in DuckDB's multithreaded engine. rows is already coerced
+    and masked (int32 codes, float64 values), so there is no type sniffing of object columns.
+    """
+    group_cols = ", ".join(map(_sql_name, filters + ["_src", "_tgt"]))
+    val = _sql_name(value_col)
+    query = f"""
+        SELECT {group_cols}, SUM({val}) AS {val}
+        FROM sankey_rows
+        GROUP BY ALL
+    """
+    # a cursor per call: its registered view is private to this session's query
+    con = _duckdb_connection().cursor()
+    try:
+        con.register("sankey_rows", rows)
+        agg = con.execute(query).df()
+    finally:
+        con.close()
+    # categoricals come back from DuckDB ENUMs as ordered; restore the input dtypes
+    return agg.astype({c: rows[c].dtype for c in filters})
+
+@st.cache_resource(show_spinner=False)
+def node_colors(agg_key, _agg, source_col, target_col):
+    """
+    Label -> color for every node of the overall Sankey, built once per aggregate, so a
+    node keeps its color in the Plant and Material views.
+    """
+    _, labels = pd.factorize(np.concatenate([_agg[source_col].to_numpy(), _agg[target_col].to_numpy()]))
+    colors = _NODE_PALETTE[np.arange(len(labels)) % _NODE_PALETTE.size]
+    return dict(zip(labels.tolist(), colors.tolist()))
 
-    # --- Build nodes
-    nodes = list(set(df[source_col]).union(set(df[target_col])))
-    node_index = {n: i for i, n in enumerate(nodes)}
-
-    # ---- calculate node totals
-    node_values = {n: 0 for n in nodes}
-    for _, row in df.iterrows():
-        node_values[row[source_col]] += row[value_col]
-        node_values[row[target_col]] += row[value_col]
-
-    # --- Build links
-    links = []
-    for _, row in df.iterrows():
-        links.append({
-            "source": node_index[row[source_col]],
-            "target": node_index[row[target_col]],
-            "value": float(row[value_col])
-        })
+@st.cache_data(show_spinner=False)
+def _sankey_arrays(df, source_col, target_col, value_col):
+    """
+    Pure Sankey preprocessing, cached so widget reruns skip it.
+    Returns (nodes, src_idx, tgt_idx, values, node_totals), or None if nothing is left to plot.
+    """
+    # --- Work on the three needed columns as NumPy arrays (no DataFrame copies).
+    # Values stay float64: d3-sankey recomputes node values from the link values and
+    # the labels print them with 2 decimals, so float32 sums would show as rounded.
+    # Filter slices come from a take, so force C-contiguous 1-D arrays before the
+    # mask and aggregation (a no-op when they already are).
+    val = np.ascontiguousarray(pd.to_numeric(df[value_col], errors="coerce").to_numpy(dtype=np.float64))
+    src = np.ascontiguousarray(df[source_col].to_numpy())
+    tgt = np.ascontiguousarray(df[target_col].to_numpy())
+
+    # one fused row mask
+    keep = _valid_rows(src, tgt, val)
+    src, tgt, val = src[keep], tgt[keep], val[keep]
+
+    if val.size == 0:
+        return None
 
-    sankey_data = {
-        "nodes": [{"name": n, "value": round(node_values[n], 3)} for n in nodes],
-        "links": links
-    }
+    # --- Build nodes: unique labels + inverse codes in one hashtable pass.
+    # Labels keep first-appearance order, so node order and colors are stable
+    # between reruns and across files with the same rows.
+    codes, uniques = pd.factorize(np.concatenate([src, tgt]))
+    nodes = uniques.tolist()
+    n = val.size
+    src_idx = codes[:n]
+    tgt_idx = codes[n:]
+
+    # ---- edge aggregation: one link per (source, target) pair, so repeated
+    # rows (e.g. one per month or plant) don't become parallel SVG paths.
+    # Each pair is one int64 code; bincount sums the values per distinct pair
+    # in a single C pass, accumulating in float64 (pairs keep first-appearance order).
+    n_nodes = len(nodes)
+    pair_idx, pairs = pd.factorize(src_idx.astype(np.int64) * n_nodes + tgt_idx)
+    val = np.bincount(pair_idx, weights=val)
+    src_idx = pairs // n_nodes
+    tgt_idx = pairs % n_nodes
+
+    if val.size > _MAX_SANKEY_LINKS:
+        nodes, src_idx, tgt_idx, val = _truncate_links(nodes, src_idx, tgt_idx, val)
+
+    # ---- calculate node totals (inflow + outflow) in a single bincount
+    totals = np.bincount(
+        np.concatenate([src_idx, tgt_idx]), weights=np.concatenate([val, val]), minlength=len(nodes)
+    )
+
+    return nodes, src_idx, tgt_idx, val, np.round(totals, 3)
 
-    sankey_html = f"""
+def _free_label(base, taken):
+    """base, or "base (2)", "base (3)", ... if a data label already uses it."""
+    label, i = base, 2
+    while label in taken:
+        label, i = f"{base} ({i})", i + 1
+    return label
+
+def _truncate_links(nodes, src_idx, tgt_idx, val, max_links=_MAX_SANKEY_LINKS):
+    """
+    Caps the Sankey at max_links links. A tenth of the budget is reserved for the remainder:
+    the largest links are kept and each source's dropped flow goes to a new "Other" node.
+    If more sources have dropped flow than the reserve allows, the ones with the smallest
+    remainders share a single "Other sources" -> "Other" link. Total flow is preserved.
+    Nodes left without links are dropped and indices renumbered.
+    """
+    reserve = max(max_links // 10, 1)
+    order = np.argsort(-val, kind="stable")
+    top, rest = order[:max_links - reserve], order[max_links - reserve:]
+
+    # fresh bucket nodes (never a data label), so no bucket link is a self-loop or a cycle
+    taken = set(nodes)
+    other = len(nodes)
+    labels = nodes + [_free_label(_OTHER_NODE, taken)]
+
+    rest_sums = np.bincount(src_idx[rest], weights=val[rest], minlength=len(labels))
+    rest_src = np.flatnonzero(rest_sums)
+    if rest_src.size > reserve:
+        # largest remainders keep their own link; the rest share one
+        by_size = rest_src[np.argsort(-rest_sums[rest_src], kind="stable")]
+        rest_src, merged = np.sort(by_size[:reserve - 1]), by_size[reserve - 1:]
+        rest_sums = np.append(rest_sums, rest_sums[merged].sum())
+        rest_src = np.append(rest_src, len(labels))
+        labels.append(_free_label(_OTHER_SOURCES_NODE, taken))
+
+    src_idx = np.concatenate([src_idx[top], rest_src])
+    tgt_idx = np.concatenate([tgt_idx[top], np.full(rest_src.size, other)])
+    val = np.concatenate([val[top], rest_sums[rest_src]])
+
+    # ---- renumber the nodes still referenced, keeping their original order
+    used = np.zeros(len(labels), dtype=bool)
+    used[src_idx] = True
+    used[tgt_idx] = True
+    new_idx = np.cumsum(used) - 1
+    return (
+        [label for label, u in zip(labels, used) if u],
+        new_idx[src_idx], new_idx[tgt_idx], val,
+    )
+
+# d3 + d3-sankey as one pinned, concatenated file: a single fetch/parse per chart iframe
+_D3_BUNDLE_URL = (
+    "https://cdn.jsdelivr.net/combine/"
+    "npm/d3@7.9.0/dist/d3.min.js,npm/d3-sankey@0.12.3/dist/d3-sankey.min.js"
+)
+
+# Page scaffolding for build_sankey_html, built once; only the payload fields are formatted per call
+_SANKEY_HTML_TEMPLATE = """
     <html>
     <head>
-        <script src="https://d3js.org/d3.v7.min.js"></script>
-        <script src="https://cdn.jsdelivr.net/npm/d3-sankey@0.12.3/dist/d3-sankey.min.js"></script>
+        <script src="{d3_bundle}"></script>
         <style>
             body {{ margin:0; }}
             text {{ font-family: Arial; font-size: 12px; }}
@@ -284,6 +532,9 @@ def plot_sankey_d3(df, source_col, target_col, value_col, title="Sankey Diagram"
             .save-btn:active{{
                 transform: scale(0.95);
             }}
+            .chart {{ position: relative; }}
+            .chart svg {{ position: relative; }}
+            .links-canvas {{ position: absolute; top: 0; left: 0; pointer-events: none; }}
         </style>
     </head>
     <body>
@@ -291,10 +542,13 @@ def plot_sankey_d3(df, source_col, target_col, value_col, title="Sankey Diagram"
             <h3 class="title">{title}</h3>
             <button class="save-btn" onclick="downloadSVG()">⬇ Save</button>
         </div>
-        <svg width="100%" height="{height}"></svg>
+        <div class="chart">
+            <canvas class="links-canvas"></canvas>
+            <svg width="100%" height="{height}"></svg>
+        </div>
 
         <script>
-            const data = {json.dumps(sankey_data)};
+            const data = {json_data};
 
             const svg = d3.select("svg");
             const width = svg.node().getBoundingClientRect().width;
@@ -305,24 +559,52 @@ def plot_sankey_d3(df, source_col, target_col, value_col, title="Sankey Diagram"
                 .nodePadding(30)
                 .extent([[10, 10], [width - 10, height - 10]]);
 
-            /* ✅ COLOR SCALE — MUST BE BEFORE USE */
-            const color = d3.scaleOrdinal(d3.schemeCategory10);
-
-            const graph = sankey(data);
+            /* links arrive column-wise; expand to the objects d3-sankey expects */
+            const L = data.links;
+            const graph = sankey({{
+                nodes: data.nodes,
+                links: L.source.map(function(s, i) {{
+                    return {{ source: s, target: L.target[i], value: L.value[i] }};
+                }})
+            }});
             const nodes = graph.nodes;
             const links = graph.links;
 
             /* ---------- LINKS ---------- */
-            svg.append("g")
-                .selectAll("path")
-                .data(links)
-                .enter()
-                .append("path")
-                .attr("d", d3.sankeyLinkHorizontal())
-                .attr("stroke", function(d) {{ return color(d.source.name); }})
-                .attr("stroke-width", function(d) {{ return Math.max(1, d.width); }})
-                .attr("fill", "none")
-                .attr("opacity", 0.6);
+            /* large graphs: one canvas pass instead of one SVG <path> per link */
+            const useCanvas = links.length > {canvas_threshold};
+            const linksCanvas = document.querySelector(".links-canvas");
+
+            if (useCanvas) {{
+                const dpr = window.devicePixelRatio || 1;
+                linksCanvas.width = width * dpr;
+                linksCanvas.height = height * dpr;
+                linksCanvas.style.width = width + "px";
+                linksCanvas.style.height = height + "px";
+
+                const lctx = linksCanvas.getContext("2d");
+                lctx.scale(dpr, dpr);
+                lctx.globalAlpha = 0.6;
+                const linkPath = d3.sankeyLinkHorizontal().context(lctx);
+                links.forEach(function(d) {{
+                    lctx.beginPath();
+                    linkPath(d);
+                    lctx.strokeStyle = d.source.color;
+                    lctx.lineWidth = Math.max(1, d.width);
+                    lctx.stroke();
+                }});
+            }} else {{
+                svg.append("g")
+                    .selectAll("path")
+                    .data(links)
+                    .enter()
+                    .append("path")
+                    .attr("d", d3.sankeyLinkHorizontal())
+                    .attr("stroke", function(d) {{ return d.source.color; }})
+                    .attr("stroke-width", function(d) {{ return Math.max(1, d.width); }})
+                    .attr("fill", "none")
+                    .attr("opacity", 0.6);
+            }}
 
             /* ---------- NODES ---------- */
             const node = svg.append("g")
@@ -336,7 +618,7 @@ def plot_sankey_d3(df, source_col, target_col, value_col, title="Sankey Diagram"
                 .attr("y", function(d) {{ return d.y0; }})
                 .attr("height", function(d) {{ return d.y1 - d.y0; }})
                 .attr("width", function(d) {{ return d.x1 - d.x0; }})
-                .attr("fill", function(d) {{ return color(d.name); }});
+                .attr("fill", function(d) {{ return d.color; }});
 
             /* ---------- LABELS ---------- */
             node.append("text")
@@ -366,6 +648,9 @@ def plot_sankey_d3(df, source_col, target_col, value_col, title="Sankey Diagram"
                 img.onload = function() {{
                     ctx.fillStyle = "white";
                     ctx.fillRect(0, 0, canvas.width, canvas.height);
+                    if (useCanvas) {{
+                        ctx.drawImage(linksCanvas, 0, 0, width, height);
+                    }}
                     ctx.drawImage(img, 0, 0);
                     const a = document.createElement("a");
                     a.download = "{title}.png";
@@ -382,8 +667,82 @@ def plot_sankey_d3(df, source_col, target_col, value_col, title="Sankey Diagram"
     </html>
     """
 
+def build_sankey_html(df, source_col, target_col, value_col, title="Sankey Diagram", height=600, colors=None):
+    """
+    Component HTML for a D3 Sankey of df, or None if there is nothing to plot.
+    colors maps node labels to colors (see node_colors); other nodes are colored by index.
+    """
+    # empty selections (e.g. a Plant/Material filter) skip hashing, preprocessing and the HTML build
+    arrays = _sankey_arrays(df, source_col, target_col, value_col) if len(df.index) else None
+    if arrays is None:
+        return None
+
+    nodes, src_idx, tgt_idx, val, node_values = arrays
+
+    # --- Build links (columnar: one array per field instead of a dict per link).
+    # Contiguous NumPy arrays go straight through orjson's NumPy path, no Python ints/floats.
+    links = {
+        "source": np.ascontiguousarray(src_idx, dtype=np.int32),
+        "target": np.ascontiguousarray(tgt_idx, dtype=np.int32),
+        "value": np.round(val, 3)  # 3 decimals like the node totals: exact labels, shorter JSON
+    }
+
+    palette = _NODE_PALETTE[np.arange(len(nodes)) % _NODE_PALETTE.size].tolist()
+    if colors:
+        palette = [colors.get(n, c) for n, c in zip(nodes, palette)]
+
+    sankey_data = {
+        "nodes": [
+            {"name": n, "value": v, "color": c}
+            for n, v, c in zip(nodes, node_values.tolist(), palette)
+        ],
+        "links": links
+    }
+
+    return _SANKEY_HTML_TEMPLATE.format(
+        title=title,
+        height=height,
+        json_data=to_json(sankey_data),
+        canvas_threshold=_CANVAS_LINK_THRESHOLD,
+        d3_bundle=_D3_BUNDLE_URL,
+    )
+
+def render_sankey_html(sankey_html, height=600):
+    if sankey_html is None:
+        st.warning("⚠️ No data available to plot the Sankey diagram.")
+        return
     components.html(sankey_html, height = height+100, scrolling=True)
 
+def remembered(slot, key, build):
+    """
+    Returns the value (HTML, or a Future for it) kept in st.session_state[slot], calling
+    build() only when key differs from the key it was built for (reruns from unrelated
+    widgets reuse it).
+    """
+    cached = st.session_state.get(slot)
+    if cached is None or cached[0] != key:
+        cached = st.session_state[slot] = (key, build())
+    return cached[1]
+
+@st.cache_resource(show_spinner=False)
+def sankey_pool():
+    # two workers: the Plant and Material Sankeys are built side by side
+    return ThreadPoolExecutor(max_workers=2)
+
+def submit_sankey_html(df, source_col, target_col, value_col, title="Sankey Diagram", height=600, colors=None):
+    """
+    Starts build_sankey_html on the worker pool and returns its Future. The worker
+    gets this rerun's script context so st.cache_data works there; st.* output
+    (render_sankey_html) stays on the script thread.
+    """
+    ctx = get_script_run_ctx()
+
+    def run():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return build_sankey_html(df, source_col, target_col, value_col, title, height, colors)
+
+    return sankey_pool().submit(run)
+
 # ============================================================
 # ✅ Page 1: Data Preview
 # ============================================================
@@ -403,21 +762,69 @@ if page == "📊 Data Visualization":
         # ---- Column Selection (once only)
         source_col, target_col, value_col = select_columns(data)
 
-        # ---- Main Sankey
-        plot_sankey_d3(data, source_col, target_col, value_col, "Overall Sankey Diagram", height=600)
+        # ---- Pre-aggregated edges, shared by all three Sankeys
+        agg_key = data_key + (source_col, target_col, value_col)
+        agg = preaggregate(data_key, data, source_col, target_col, value_col)
+        colors = node_colors(agg_key, agg, source_col, target_col)
+
+        # ---- Main Sankey (HTML kept in session state until the upload or columns change)
+        overall_html = remembered(
+            "overall_sankey", agg_key,
+            lambda: build_sankey_html(agg, source_col, target_col, value_col, "Overall Sankey Diagram", height=600, colors=colors),
+        )
+        render_sankey_html(overall_html, height=600)
 
         # ---- Optional Plant & Material Filters
-        col1, col2 = st.columns(2)
-        with col1:
-
-            if "Plant" in data.columns:
-                selected_plant = st.selectbox("Select Plant", sorted(data["Plant"].dropna().unique()))
-                plant_df = data[data["Plant"] == selected_plant]
-                plot_sankey_d3(plant_df, source_col, target_col, value_col, f"Sankey for Plant: {selected_plant}", height=500)
-        with col2:
-            if "Material" in data.columns:
-                selected_material = st.selectbox("Select Material", sorted(data["Material"].dropna().unique()))
-                material_df = data[data["Material"] == selected_material]
-                plot_sankey_d3(material_df, source_col, target_col, value_col, f"Sankey for Material: {selected_material}", height=500)
+        has_plant = "Plant" in data.columns
+        has_material = "Material" in data.columns
+
+        if has_plant or has_material:
+            # filtered Sankeys are opt-in: nothing below is filtered or built until enabled
+            with st.expander("🔎 Plant & Material Drill-down", expanded=False):
+                if st.checkbox("Show filtered Sankeys", key="show_drilldown"):
+                    # one form: both selections are applied together in a single rerun
+                    with st.form("sankey_filters"):
+                        col1, col2 = st.columns(2)
+                        # categories were sorted once at load: passed as-is, no per-rerun unique/sort/list
+                        if has_plant:
+                            selected_plant = col1.selectbox("Select Plant", data["Plant"].cat.categories, key="plant_sel")
+                        if has_material:
+                            selected_material = col2.selectbox("Select Material", data["Material"].cat.categories, key="material_sel")
+                        st.form_submit_button("Apply")
+
+                    # both filtered Sankeys are built concurrently, then rendered in order;
+                    # an empty selection is reported without submitting any work. The Futures are
+                    # remembered per (columns, selection): only a changed side is rebuilt, and an
+                    # unchanged one resolves immediately on later reruns.
+                    if has_plant:
+                        plant_df = filter_eq(agg_key, agg, "Plant", selected_plant)
+                        plant_empty = len(plant_df.index) == 0
+                        if not plant_empty:
+                            plant_future = remembered(
+                                "plant_sankey", agg_key + (selected_plant,),
+                                lambda: submit_sankey_html(plant_df, source_col, target_col, value_col, f"Sankey for Plant: {selected_plant}", height=500, colors=colors),
+                            )
+                    if has_material:
+                        material_df = filter_eq(agg_key, agg, "Material", selected_material)
+                        material_empty = len(material_df.index) == 0
+                        if not material_empty:
+                            material_future = remembered(
+                                "material_sankey", agg_key + (selected_material,),
+                                lambda: submit_sankey_html(material_df, source_col, target_col, value_col, f"Sankey for Material: {selected_material}", height=500, colors=colors),
+                            )
+
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        if has_plant:
+                            if plant_empty:
+                                st.info(f"No rows for Plant: {selected_plant}")
+                            else:
+                                render_sankey_html(plant_future.result(), height=500)
+                    with col2:
+                        if has_material:
+                            if material_empty:
+                                st.info(f"No rows for Material: {selected_material}")
+                            else:
+                                render_sankey_html(material_future.result(), height=500)
     else:
         st.info("Please upload a file to view Sankey diagrams.")